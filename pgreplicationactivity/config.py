@@ -24,14 +24,8 @@ COLS = {'lag': [{'name': 'host', 'title': 'HOST', 'template_h': '%-25s ',
                  'flag': 'LAGB', 'mandatory': False},
                 {'name': 'wal_sec', 'title': 'WAL MB/s', 'template_h': '%10s ',
                  'flag': 'WALS', 'mandatory': False}]}
-FLAGS = {}
-FLAGS['NONE'] = 0
-VALUE = 1
-for flag in ['UPSTREAM', 'LSN', 'RECCONF', 'STBYMODE', 'SLOT', 'LAGS', 'ROLE',
-             'LAGB', 'WALS']:
-    FLAGS[flag] = VALUE
-    VALUE *= 2
-del VALUE
+FLAGS = {'NONE': 0, 'UPSTREAM': 1, 'LSN': 2, 'RECCONF': 4, 'STBYMODE': 8,
+         'SLOT': 16, 'LAGS': 32, 'ROLE': 64, 'LAGB': 128, 'WALS': 256}
 
 C_BLACK_GREEN = 1
 C_CYAN = 2
@@ -47,5 +41,8 @@ C_GRAY = 10
 # Maximum number of column
 MAX_NCOL = 14
 
+# Maximum factor the refresh time is stretched by while nothing changes
+MAX_IDLE_INTERVAL = 4
+
 SORT_KEYS = {'u': 'upstream', 's': 'slot', 'r': 'role', 'm': 'lag_sec',
              'w': 'lag_mb', 'l': 'lsn'}
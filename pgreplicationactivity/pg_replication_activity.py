@@ -32,16 +32,14 @@ import sys
 import signal
 import argparse
 import logging
-import psycopg2
-from psycopg2 import errorcodes
 
-from pgreplicationactivity import ui, pgconnection
+from pgreplicationactivity import ui
 
 if os.name != 'posix':
     sys.exit("FATAL: Platform not supported.")
 
-# Create the UI
-PGAUI = ui.UI()
+# The UI, created by main()
+PGAUI = None
 
 
 def get_arguments():
@@ -92,6 +90,8 @@ def get_arguments():
 
 def main():
     """Run the main entrypoint."""
+    global PGAUI  # pylint: disable=W0603
+    PGAUI = ui.UI()
     signal.signal(signal.SIGTERM, PGAUI.signal_handler)
     args = get_arguments()
     if args.debug:
@@ -111,6 +111,8 @@ def main():
         disp_procs = None
         # indentation
         indent = PGAUI.get_indent(flag)
+        # The version does not change while we are running
+        pg_version = PGAUI.data.get_pg_version()
         # Init curses
         PGAUI.init_curses()
         # color ?
@@ -127,11 +129,14 @@ def main():
             if PGAUI.get_mode() != old_pgtop_mode:
                 indent = PGAUI.get_indent(flag)
             lag_info = new_lag_info
+            # Before the refresh, so the header shows the interval that comes next.
+            # It is based on the rows that poll() returns for display.
+            interval = PGAUI.next_interval(disp_procs)
             # get active connections
             PGAUI.set_buffer({
                 'procs': disp_procs,
                 'conn_string': connstr,
-                'pg_version': PGAUI.data.get_pg_version(),
+                'pg_version': pg_version,
                 'flag': flag,
                 'indent': indent,
                 'tps': 9,
@@ -141,7 +146,6 @@ def main():
             })
             # refresh
             PGAUI.refresh_window()
-            interval = 1
 
     except KeyboardInterrupt:
         PGAUI.at_exit_curses()
@@ -152,10 +156,15 @@ def main():
         if args.debug:
             logging.exception("FATAL: %s", str(err))
         sys.exit("FATAL: %s" % (str(err)))
+    finally:
+        # Also on sys.exit() from the UI, close the server connections right away
+        if PGAUI.data is not None:
+            PGAUI.data.disconnect()
 
 
 def check_for_password_error(err):
     """Check if an error is a password error."""
+    from psycopg2 import errorcodes
     msg = str(err).strip()
     if msg.startswith("FATAL:  password authentication failed "
                       "for user"):
@@ -169,6 +178,9 @@ def check_for_password_error(err):
 
 def try_connecting(args):
     """Try connecting and retry with password if needed."""
+    # psycopg2 is only loaded once we really connect, so --help stays fast
+    import psycopg2
+    from pgreplicationactivity import pgconnection
     password = os.environ.get('PGPASSWORD')
     nb_try = 0
     while nb_try < 2:
@@ -189,5 +201,10 @@ def try_connecting(args):
                     logging.exception(str(err).strip())
                 sys.exit("pg_activity: FATAL: %s" %
                          (ui.clean_str(str(err),)))
+        except pgconnection.PGConnectionException as err:
+            sys.exit("pg_activity: FATAL: %s" % (err,))
 
-    return pgconnection.dsn_to_connstr({k: v for k, v in dsn.items() if k != 'password'})
+    # Never display the password
+    dsn = dict(dsn)
+    dsn.pop('password', None)
+    return pgconnection.dsn_to_connstr(dsn)
@@ -25,17 +25,66 @@ MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS.
 """
 
 import os
-from copy import copy
+from concurrent.futures import ThreadPoolExecutor
+import functools
 import logging
 import re
 import time
 import psycopg2
+from psycopg2 import errorcodes
 from psycopg2 import sql
+from psycopg2.extensions import parse_dsn
 
-RE_QUOTE = re.compile('''['"]''')
+CONFBOOL_TRUE = frozenset(('on', 'true', 'yes', '1'))
+CONFBOOL_FALSE = frozenset(('off', 'false', 'no', '0'))
+RE_PG_VERSION = re.compile(r"^(PostgreSQL|EnterpriseDB) ([0-9]+)\.([0-9]+)(?:\.([0-9]+))?")
+RE_PG_DEVEL = re.compile(
+    r"^(PostgreSQL|EnterpriseDB) ([0-9]+)(?:\.([0-9]+))?(devel|beta[0-9]+|rc[0-9]+)")
+
+# Characters that make libpq need a dsn value to be quoted
+RE_DSN_SPECIAL = re.compile(r"[\s'\\]")
 
 LOGGER = logging.getLogger('pgconnection')
 
+# Connection defaults that keep one unreachable server from stalling a refresh.
+# Each is only applied when neither the dsn nor the environment variable (if any) sets it.
+# With a service none are applied, because libpq ranks them above the service definition.
+CONNECT_DEFAULTS = {
+    'connect_timeout': ('PGCONNECT_TIMEOUT', 3),
+    'keepalives': (None, 1),
+    'keepalives_idle': (None, 30),
+    'keepalives_interval': (None, 10),
+    'keepalives_count': (None, 3),
+    'options': ('PGOPTIONS', '-c statement_timeout=2000'),
+}
+
+# recovery.conf hardly ever changes, so it is read again at most every so many seconds
+RECOVERYCONF_TTL = 30
+
+# What get_standby_info and current_time_lag_lsn return for a server that is down
+STANDBY_INFO_DOWN = {'role': 'Down', 'upstream': '', 'recovery_conf': False,
+                     'standby_mode': False, 'replication_slot': ''}
+TIME_LAG_LSN_DOWN = {'now': None, 'lsn_int': 0, 'lsn': None, 'lag_sec': None, 'wal_sec': 0}
+
+# Time, lag and lsn of a server in one round-trip, for a master as well as a standby.
+# The lsn functions are filled in per server version from TIME_LAG_LSN_FUNCTIONS.
+TIME_LAG_LSN_SQL = ('select pg_is_in_recovery() as recovery, now() as now, '
+                    'case when pg_is_in_recovery() then {0}() else {1}() end as lsn, '
+                    'case when pg_is_in_recovery() then extract( epoch from now() - '
+                    'pg_last_xact_replay_timestamp())::int else 0 end as lag_sec')
+TIME_LAG_LSN_FUNCTIONS = {
+    False: ('pg_last_xlog_replay_location', 'pg_current_xlog_location'),
+    True: ('pg_last_wal_replay_lsn', 'pg_current_wal_lsn'),
+}
+
+# Role and wal receiver conninfo of a server in one round-trip.
+# For pg 9.5, we cannot use pg_stat_wal_receiver.
+STANDBY_STATUS_SQL = {
+    False: 'select pg_is_in_recovery() as recovery, null::text as conninfo',
+    True: 'select pg_is_in_recovery() as recovery, '
+          '(select conninfo from pg_stat_wal_receiver) as conninfo',
+}
+
 
 class PGConnectionException(Exception):
     """This exception is raised when invalid data is fed to a PGConnectionException."""
@@ -51,18 +100,29 @@ class PGConnection():
     functionality through methods of this class, like is_super, is_standby, etc.
     """
 
+    # One instance exists per server, and get_standby_info reads these on every refresh
+    __slots__ = ('__dsn_params', '__role', '__conn', 'pg_version', 'pg_num_version',
+                 '__recoveryconf', '__recoveryconf_read', '__wal_per_sec', '__is_super',
+                 '__prepared', '__cursor', '__time_lag_lsn_sql', '__server_address')
+
     def __init__(self, dsn_params=None, role=None):
         """Init the PGConnection class."""
         if not isinstance(dsn_params, dict) or not dsn_params:
             raise PGConnectionException('Init PGConnection class with a dict of '
                                         'connection parameters')
-        self.__dsn_params = copy(dsn_params)
+        self.__dsn_params = dict(dsn_params)
         self.__role = role
         self.__conn = {}
+        self.__cursor = {}
+        self.__prepared = {}
         self.pg_version = None
         self.pg_num_version = None
         self.__recoveryconf = None
+        self.__recoveryconf_read = None
         self.__wal_per_sec = None
+        self.__is_super = None
+        self.__time_lag_lsn_sql = None
+        self.__server_address = None
 
     def connect(self, database: str = 'postgres'):
         """
@@ -72,21 +132,33 @@ class PGConnection():
         during init, or a previous connect. If a succesful connection is already
         there, connect will be skipped.
         """
-        try:
-            if not self.__conn[database].closed:
+        conn = self.__conn.get(database)
+        if conn is not None:
+            if not conn.closed:
                 return
-        except (KeyError, AttributeError):
-            pass
+            # A connection that broke still holds its libpq resources until it is closed
+            self.disconnect(database)
         # Split 'host=127.0.0.1 dbname=postgres' in {'host': '127.0.0.1', 'dbname': 'postgres'}
-        dsn_params = copy(self.__dsn_params)
-        dsn_params['dbname'] = database
+        dsn_params = dict(self.__dsn_params, dbname=database)
 
         # Join {'host': '127.0.0.1', 'dbname': 'postgres'} into 'host=127.0.0.1 dbname=postgres'
         connstr = dsn_to_connstr(dsn_params)
-        self.__conn[database] = conn = psycopg2.connect(connstr)
+        defaults = {}
+        if 'service' not in dsn_params and 'PGSERVICE' not in os.environ:
+            for key, (envvar, value) in CONNECT_DEFAULTS.items():
+                if key not in dsn_params and not (envvar and envvar in os.environ):
+                    defaults[key] = value
+        self.__conn[database] = conn = psycopg2.connect(connstr, **defaults)
         conn.autocommit = True
+        # One cursor is reused for every query on this connection
+        self.__cursor[database] = cur = conn.cursor()
+        # Facts cached per physical connection are reset on every (re)connect.
+        # __prepared holds None instead of a set when prepared statements do not stick.
+        self.__prepared[database] = set()
+        self.__is_super = None
+        self.__server_address = None
+        self.__recoveryconf_read = None
         if self.__role:
-            cur = conn.cursor()
             cur.execute(sql.SQL('set role {}').format(sql.Identifier(self.__role)))
 
     def disconnect(self, database: str = ''):
@@ -95,14 +167,17 @@ class PGConnection():
 
         If no DB connection is named, all connections are closed.
         """
-        if database:
-            databases = [database]
-        else:
-            databases = [db for db in self.__conn]
+        databases = [database] if database else list(self.__conn)
         for database_name in databases:
+            conn = self.__conn.pop(database_name, None)
+            self.__cursor.pop(database_name, None)
+            if conn is None:
+                continue
+            # Close the socket now, instead of whenever the object is collected
             try:
-                del self.__conn[database_name]
-            except KeyError:
+                conn.close()
+            except psycopg2.Error:
+                # A broken connection is gone as far as we are concerned
                 pass
 
     def connection_dsn(self, database: str = 'postgres'):
@@ -123,8 +198,29 @@ class PGConnection():
         as a list of dictionaries, e.a.:
           [{'name': 'postgres', 'oid': 12345}, {'name': 'template1', 'oid': 12346}]).
         """
+        cur = self.__execute(query, parameters, database)
+        try:
+            columns = [i[0] for i in cur.description]
+        except TypeError:
+            return None
+        return [dict(zip(columns, row)) for row in cur.fetchall()]
+
+    def run_scalar(self, query, parameters=None, database: str = 'postgres'):
+        """
+        Run a query that returns one value with this PgConnection class.
+
+        The first column of the first row is returned as is, or None if there are no rows.
+        This saves building the dictionaries that run_sql() returns.
+        """
+        row = self.__execute(query, parameters, database).fetchone()
+        if row is None:
+            return None
+        return row[0]
+
+    def __execute(self, query, parameters, database):
+        """Execute a query on the cursor of a database and return the cursor."""
         self.connect(database=database)
-        cur = self.__conn[database].cursor()
+        cur = self.__cursor[database]
         try:
             LOGGER.debug('query: %s', query)
             cur.execute(query, parameters)
@@ -132,13 +228,53 @@ class PGConnection():
             if LOGGER.getEffectiveLevel() <= logging.DEBUG:
                 LOGGER.exception(str(error))
             raise
+        return cur
+
+    def run_prepared(self, name, query, database: str = 'postgres'):
+        """
+        Run a constant query as a server side prepared statement.
+
+        The statement is prepared once per connection and executed by name after that,
+        so the server does not parse and plan it again on every refresh.
+        Behind a transaction pooler, where statements do not stick to a server session,
+        it falls back to running queries as is, until the next reconnect.
+        Results are returned like run_sql() does.
+        """
+        self.connect(database=database)
+        prepared = self.__prepared[database]
+        if prepared is None:
+            # Prepared statements do not stick on this connection, see below
+            return self.run_sql(query, database=database)
+        if name not in prepared:
+            self.__prepare(name, query, database)
         try:
-            columns = [i[0] for i in cur.description]
-        except TypeError:
-            return None
-        ret = [dict(zip(columns, row)) for row in cur.fetchall()]
-        cur.close()
-        return ret
+            return self.run_sql('EXECUTE {0}'.format(name), database=database)
+        except psycopg2.Error as error:
+            if error.pgcode != errorcodes.INVALID_SQL_STATEMENT_NAME:
+                raise
+        # The statement was dropped behind our back (e.a. DISCARD ALL by a pooler).
+        # Prepare it once more, but not endlessly.
+        prepared.discard(name)
+        self.__prepare(name, query, database)
+        try:
+            return self.run_sql('EXECUTE {0}'.format(name), database=database)
+        except psycopg2.Error as error:
+            if error.pgcode != errorcodes.INVALID_SQL_STATEMENT_NAME:
+                raise
+        # Still gone, so a transaction pooler hands us another session for every statement.
+        # Until the next reconnect, all queries on this connection are just run as is.
+        self.__prepared[database] = None
+        return self.run_sql(query, database=database)
+
+    def __prepare(self, name, query, database):
+        """Prepare a statement, and remember that it is prepared on this connection."""
+        try:
+            self.run_sql('PREPARE {0} AS {1}'.format(name, query), database=database)
+        except psycopg2.Error as error:
+            # A pooler can hand us a server session where this name was prepared before
+            if error.pgcode != errorcodes.DUPLICATE_PREPARED_STATEMENT:
+                raise
+        self.__prepared[database].add(name)
 
     def connected(self):
         """
@@ -157,9 +293,13 @@ class PGConnection():
         Check if the user is a superuser.
 
         This simple helper function detects if the current user is conencted as superuser.
+        The result is cached for as long as the underlying connection lives.
         """
-        result = self.run_sql('select rolsuper from pg_roles where rolname = CURRENT_USER')
-        return result[0]['rolsuper']
+        self.connect()
+        if self.__is_super is None:
+            self.__is_super = self.run_scalar('select rolsuper from pg_roles '
+                                              'where rolname = CURRENT_USER')
+        return self.__is_super
 
     def is_standby(self):
         """
@@ -167,7 +307,7 @@ class PGConnection():
 
         This simple helper function detects if this instance is an standby.
         """
-        result = self.run_sql('SELECT pg_is_in_recovery() AS recovery')
+        result = self.run_prepared('pra_is_standby', 'SELECT pg_is_in_recovery() AS recovery')
         return result[0]['recovery']
 
     def port(self):
@@ -179,10 +319,13 @@ class PGConnection():
         If it cannot read it from dsn, it will use default (5432).
         """
         try:
-            result = self.run_sql("select inet_server_port() as port")
-            return result[0]['port']
+            return self.__server_addr_port()[1]
         except psycopg2.OperationalError:
             pass
+        return self.__dsn_port()
+
+    def __dsn_port(self):
+        """Return the port from the dsn params, for when Postgres cannot tell."""
         # Read it from DSN, if its not there from PGPORT env var, if not there default to 5432
         return self.__dsn_params.get('port', os.environ.get('PGPORT', '5432'))
 
@@ -195,10 +338,26 @@ class PGConnection():
         If it cannot read it from dsn, it will return None.
         """
         try:
-            result = self.run_sql("select inet_server_addr() as ip")
-            return result[0]['ip']
+            return self.__server_addr_port()[0]
         except psycopg2.OperationalError:
             pass
+        return self.__dsn_address()
+
+    def __server_addr_port(self):
+        """
+        Return the ip and port that the Postgres server is attached to.
+
+        Both are read in one round-trip, and remembered for as long as the
+        underlying connection lives.
+        """
+        if self.__server_address is None:
+            # Run once per connection, so there is nothing to gain from preparing it
+            result = self.run_sql('select inet_server_addr() as ip, inet_server_port() as port')
+            self.__server_address = (result[0]['ip'], result[0]['port'])
+        return self.__server_address
+
+    def __dsn_address(self):
+        """Return the address from the dsn params, for when Postgres cannot tell."""
         address = self.__dsn_params.get('host', os.environ.get('PGHOST', ''))
         if ',' in address:
             # Multiple connections in dsn, so this is not one of the specific connections
@@ -214,8 +373,12 @@ class PGConnection():
 
         It is constructed from the ip and port that the Postgres server is
         attached to inet_server_addr, and inet_server_port.
+        Both are read in one round-trip.
         """
-        address, port = self.address(), self.port()
+        try:
+            address, port = self.__server_addr_port()
+        except psycopg2.OperationalError:
+            address, port = self.__dsn_address(), self.__dsn_port()
         if address:
             return '{0}:{1}'.format(address, port)
         if 'service' in self.__dsn_params:
@@ -224,12 +387,14 @@ class PGConnection():
 
     def get_upstream(self):
         """Calculate the upstream server for a standby."""
-        conninfo = None
+        # Shares its prepared statement with get_standby_info
+        result = self.run_prepared('pra_standby_status',
+                                   STANDBY_STATUS_SQL[self.get_num_version() >= 90600])
+        return self.__upstream_from_conninfo(result[0]['conninfo'])
+
+    def __upstream_from_conninfo(self, conninfo):
+        """Calculate the upstream server from the conninfo of the wal receiver, if any."""
         prefix = 'v'
-        if self.get_num_version() >= 90600:
-            conninfo = self.run_sql('select conninfo from pg_stat_wal_receiver')
-            if conninfo:
-                conninfo = conninfo[0]['conninfo']
         if not conninfo:
             # if there is no line in pg_stat_wal_receiver, there is no receiver.
             # For pg 9.5, we cannot use pg_stat_wal_receiver.
@@ -248,6 +413,8 @@ class PGConnection():
             else:
                 port = 5432
             return '{0}: {1}:{2}'.format(prefix, dsn['host'], port)
+        except PGConnectionException:
+            return '?'
         except KeyError:
             # Seems there is no record in pg_stat_wal_receiver. This is a master.
             return ''
@@ -258,32 +425,25 @@ class PGConnection():
 
         We can use this info to display time drift.
         """
-        if not self.connected():
-            return {'now': None, 'lsn_int': 0, 'lsn': None, 'lag_sec': None, 'wal_sec': 0}
-
-        if self.is_standby():
-            if self.get_num_version() >= 100000:
-                result = self.run_sql('select now() as now, pg_last_wal_replay_lsn() as lsn, '
-                                      'extract( epoch from now() - '
-                                      'pg_last_xact_replay_timestamp())::int as lag_sec ')
-            else:
-                # This works on a standby of 9.5
-                result = self.run_sql('select now() as now, pg_last_xlog_replay_location() as lsn, '
-                                      'extract( epoch from now() - '
-                                      'pg_last_xact_replay_timestamp())::int as lag_sec ')
-        else:
-            if self.get_num_version() >= 100000:
-                # This works on a master. For PG10, we cannot use pg_current_xlog_location(),
-                # but should use pg_current_wal_lsn() instead
-                result = self.run_sql('select now() as now, pg_current_wal_lsn() as lsn, '
-                                      '0 as lag_sec')
-            else:
-                # This works on a master. with a version lower than  PG10
-                result = self.run_sql('select now() as now, pg_current_xlog_location() as lsn, '
-                                      '0 as lag_sec')
+        # No separate connected() check: a server that is down simply fails the query below,
+        # which saves a round-trip on every refresh for the servers that are up.
+        # Standby or master is decided by the same query, which saves another one.
+        result = None
+        try:
+            if self.__time_lag_lsn_sql is None:
+                num_version = self.get_num_version()
+                if num_version:
+                    # PG10 renamed the xlog functions to wal functions
+                    functions = TIME_LAG_LSN_FUNCTIONS[num_version >= 100000]
+                    self.__time_lag_lsn_sql = TIME_LAG_LSN_SQL.format(*functions)
+            if self.__time_lag_lsn_sql:
+                result = self.run_prepared('pra_time_lag_lsn', self.__time_lag_lsn_sql)
+        except psycopg2.OperationalError:
+            pass
         if result:
             result = result[0]
-            newlsn, newepoch = lsn_to_xlogbyte(result['lsn']), time.time()
+            del result['recovery']
+            newlsn, newepoch = lsn_to_xlogbyte(result['lsn']), time.monotonic()
             result['lsn_int'] = newlsn
             if self.__wal_per_sec:
                 oldlsn, oldepoch = self.__wal_per_sec
@@ -292,21 +452,28 @@ class PGConnection():
                 result['wal_sec'] = 0
             self.__wal_per_sec = (newlsn, newepoch)
             return result
-        return {'now': None, 'lsn_int': 0, 'lsn': None, 'lag_sec': None, 'wal_sec': 0}
+        return dict(TIME_LAG_LSN_DOWN)
 
     def get_standby_info(self):
         """Return the replication info of all connected servers."""
+        # The host is filled in by PGMultiConnection, which knows it by its hostid
         ret = {}
-        ret['host'] = self.hostid()
+        # A server that is down costs one connection attempt per refresh, and no more:
+        # get_num_version() connects, and returns None when that fails.
+        num_version = self.get_num_version()
         try:
-            if self.is_standby():
-                ret['role'] = 'standby'
-                ret['upstream'] = self.get_upstream()
-            else:
-                ret['role'] = 'master'
-                ret['upstream'] = ''
+            if num_version is None:
+                return dict(STANDBY_INFO_DOWN)
+            # Role and wal receiver are read in one round-trip
+            result = self.run_prepared('pra_standby_status',
+                                       STANDBY_STATUS_SQL[num_version >= 90600])[0]
         except psycopg2.OperationalError:
-            ret['role'] = 'Down'
+            return dict(STANDBY_INFO_DOWN)
+        if result['recovery']:
+            ret['role'] = 'standby'
+            ret['upstream'] = self.__upstream_from_conninfo(result['conninfo'])
+        else:
+            ret['role'] = 'master'
             ret['upstream'] = ''
         try:
             recoveryconf = self.recoveryconf()
@@ -325,75 +492,58 @@ class PGConnection():
         return ret
 
     def get_pg_version(self,):
-        """Run pg_version and return its result."""
-        if not self.pg_version:
-            self.get_num_version()
+        """
+        Run pg_version and return its result.
+
+        SELECT version() is only run and parsed once, for the short version that is displayed.
+        """
+        if self.pg_version:
+            return self.pg_version
+        try:
+            text_version = self.run_scalar('SELECT version()')
+        except psycopg2.OperationalError:
+            return None
+        try:
+            self.pg_version = parse_pg_version(text_version)[0]
+        except PGConnectionException:
+            self.pg_version = text_version
         return self.pg_version
 
     def get_num_version(self):
         """
-        Get PostgreSQL short & numeric version.
+        Get PostgreSQL numeric version.
 
-        It is read from SELECT version().
+        libpq reports it for every connection, so it needs no query and no parsing.
         """
         if self.pg_num_version:
             return self.pg_num_version
         try:
-            pg_version = self.run_sql("SELECT version() AS pg_version")
+            self.connect()
         except psycopg2.OperationalError:
             return None
-        text_version = pg_version[0]['pg_version']
-        # First try as normal version number
-        res = re.match(
-            r"^(PostgreSQL|EnterpriseDB) ([0-9]+)\.([0-9]+)(?:\.([0-9]+))?",
-            text_version)
-        if res is not None:
-            rmatch = res.group(2)
-            if int(res.group(3)) < 10:
-                rmatch += '0'
-            rmatch += res.group(3)
-            if res.group(4) is not None:
-                if int(res.group(4)) < 10:
-                    rmatch += '0'
-                rmatch += res.group(4)
-            else:
-                rmatch += '00'
-            self.pg_version = str(res.group(0))
-            self.pg_num_version = int(rmatch)
-            return self.pg_num_version
-
-        # Okay, then try with devel version number
-        res = re.match(
-            r"^(PostgreSQL|EnterpriseDB) ([0-9]+)(?:\.([0-9]+))?(devel|beta[0-9]+|rc[0-9]+)",
-            text_version)
-        if res is not None:
-            rmatch = res.group(2)
-            if res.group(3) is not None:
-                if int(res.group(3)) < 10:
-                    rmatch += '0'
-                rmatch += res.group(3)
-            else:
-                rmatch += '00'
-            rmatch += '00'
-            self.pg_version = str(res.group(0))
-            self.pg_num_version = int(rmatch)
-            return self.pg_num_version
-
-        # Seems we cannot deduce version number.
-        raise Exception('Undefined PostgreSQL version.')
+        self.pg_num_version = self.__conn['postgres'].server_version
+        return self.pg_num_version
 
     def recoveryconf(self):
         """
         Read data from recovery.conf.
 
         This uses pg_read_file, which can only be executed by a superuser.
+        From PG12 on there is no recovery.conf, and the same data is read from
+        the settings and the standby.signal file instead.
+        The result is reused for RECOVERYCONF_TTL seconds.
         """
         if not self.is_super():
             return None
+        if self.__recoveryconf_read is not None and \
+           time.monotonic() - self.__recoveryconf_read < RECOVERYCONF_TTL:
+            return self.__recoveryconf
+        if (self.get_num_version() or 0) >= 120000:
+            return self.__recovery_settings()
         try:
-            result = self.run_sql("select pg_read_file('recovery.conf') as recoveryconf")
+            result = self.run_scalar("select pg_read_file('recovery.conf')")
             self.__recoveryconf = ret = {}
-            for line in result[0]['recoveryconf'].split('\n'):
+            for line in result.split('\n'):
                 line = line.strip()
                 if '=' not in line:
                     continue
@@ -402,6 +552,29 @@ class PGConnection():
                 ret[key] = value
         except psycopg2.OperationalError:
             self.__recoveryconf = ret = False
+        self.__recoveryconf_read = time.monotonic()
+        return ret
+
+    def __recovery_settings(self):
+        """
+        Read the recovery settings of PG12 and newer, like recoveryconf() reads recovery.conf.
+
+        Without a standby.signal file the settings are not used, like without a recovery.conf.
+        """
+        try:
+            result = self.run_sql("select pg_stat_file('standby.signal', true) is not null "
+                                  "as standby_mode, "
+                                  "current_setting('primary_conninfo') as primary_conninfo, "
+                                  "current_setting('primary_slot_name') as primary_slot_name")
+            result = result[0]
+            if result['standby_mode']:
+                result['standby_mode'] = 'on'
+                self.__recoveryconf = ret = result
+            else:
+                self.__recoveryconf = ret = False
+        except psycopg2.OperationalError:
+            self.__recoveryconf = ret = False
+        self.__recoveryconf_read = time.monotonic()
         return ret
 
 
@@ -418,9 +591,10 @@ class PGMultiConnection():
         if not isinstance(dsn_params, dict) or not dsn_params:
             raise PGConnectionException('Init PGConnection class with a dict of '
                                         'connection parameters')
-        self.__dsn_params = copy(dsn_params)
+        self.__dsn_params = dict(dsn_params)
         self.__role = role
         self.__conn = {}
+        self.__executor = None
 
     def connect(self, database: str = 'postgres'):
         """
@@ -441,8 +615,7 @@ class PGMultiConnection():
         except (KeyError, AttributeError):
             pass
         # Split 'host=127.0.0.1 dbname=postgres' in {'host': '127.0.0.1', 'dbname': 'postgres'}
-        dsn_params = copy(self.__dsn_params)
-        dsn_params['dbname'] = database
+        dsn_params = dict(self.__dsn_params, dbname=database)
         ports = dsn_params.get('port', os.environ.get('PGPORT', '5432')).split(',')
         hosts = dsn_params.get('host', os.environ.get('PGHOST'))
         if hosts:
@@ -451,15 +624,14 @@ class PGMultiConnection():
                 ports = ports * len(hosts)
             if len(hosts) != len(ports):
                 raise PGConnectionException('you cannot specify less or more ports than hosts')
-            for i, _ in enumerate(hosts):
-                dsn_params = copy(dsn_params)
-                dsn_params['host'] = hosts[i]
-                dsn_params['port'] = ports[i]
-                try:
-                    new_con = PGConnection(dsn_params, self.__role)
-                    hostid = new_con.hostid()
-                except psycopg2.OperationalError:
-                    hostid = '{0}:{1}'.format(dsn_params['host'], dsn_params['port'])
+            # Every host gets its own copy of the shared params
+            candidates = [PGConnection(dict(dsn_params, host=host, port=port), self.__role)
+                          for host, port in zip(hosts, ports)]
+            # Connecting and asking for the hostid is done for all hosts in parallel.
+            # hostid() falls back to host:port from the dsn for hosts that are down.
+            with ThreadPoolExecutor(max_workers=len(candidates)) as executor:
+                hostids = list(executor.map(PGConnection.hostid, candidates))
+            for hostid, new_con in zip(hostids, candidates):
                 if hostid in self.__conn:
                     new_con.disconnect()
                 else:
@@ -474,6 +646,20 @@ class PGMultiConnection():
         self.__conn[hostid] = new_con
         self.multiconnect_from_service(database)
 
+    def disconnect(self):
+        """
+        Disconnect from all instances.
+
+        All connections are closed, and the threads that queried them are stopped.
+        """
+        for connection in self.__conn.values():
+            connection.disconnect()
+        self.__conn.clear()
+        if self.__executor is not None:
+            # The connections are closed already, so there is nothing left to wait for
+            self.__executor.shutdown(wait=False)
+            self.__executor = None
+
     def multiconnect_from_service(self, database: str = 'postgres'):
         """Create multiple connections from one connection being made from a service description."""
         if len(self.__conn) != 1:
@@ -509,27 +695,37 @@ class PGMultiConnection():
 
     def get_standby_info(self):
         """Return the replication info of all connected servers."""
-        ret = []
-        for key, connection in self.__conn.items():
-            lag_info = connection.get_standby_info()
-            lag_info['host'] = key
-            ret.append(lag_info)
+        hosts = list(self.__conn)
+        connections = [self.__conn[host] for host in hosts]
+        # Every server has its own connection, so they can all be queried in parallel.
+        # The worker threads are kept, instead of being started again on every refresh.
+        if self.__executor is None:
+            self.__executor = ThreadPoolExecutor(max_workers=max(len(connections), 1))
+        executor = self.__executor
+        ret = list(executor.map(PGConnection.get_standby_info, connections))
+        for host, lag_info in zip(hosts, ret):
+            lag_info['host'] = host
         # To keep time distance between these queries as short as possible
-        # These queries are run in a seperate run.
-        for lag_info in ret:
-            hostid = lag_info['host']
-            connection = self.__conn[hostid]
-            lag_info.update(connection.current_time_lag_lsn())
-        # We now detect the latest LSN and now from all servers.
+        # These queries are run in a seperate run, on all servers in parallel.
+        # Servers that were found down in the first pass are not tried again in this refresh
+        time_lag_lsns = iter(executor.map(PGConnection.current_time_lag_lsn,
+                                          [connection for connection, lag_info
+                                           in zip(connections, ret)
+                                           if lag_info['role'] != 'Down']))
+        # While collecting, we detect the latest LSN and now from all servers.
         # This will act as reference for drift and lag_bytes.
-        try:
-            max_now = max([li['now'] for li in ret if li['now']])
-        except ValueError:
-            max_now = None
-        try:
-            max_lsn = max([li['lsn_int'] for li in ret if li['lsn_int']])
-        except ValueError:
-            max_lsn = None
+        max_now, max_lsn = None, 0
+        for lag_info in ret:
+            if lag_info['role'] == 'Down':
+                lag_info.update(TIME_LAG_LSN_DOWN)
+            else:
+                lag_info.update(next(time_lag_lsns))
+            now = lag_info['now']
+            if now and (max_now is None or now > max_now):
+                max_now = now
+            # lsn_int was parsed by current_time_lag_lsn, and is 0 for servers that are down
+            if lag_info['lsn_int'] > max_lsn:
+                max_lsn = lag_info['lsn_int']
 
         # Now just calculate drift and lag_bytes
         for lag_info in ret:
@@ -545,8 +741,10 @@ class PGMultiConnection():
 
     def get_pg_version(self,):
         """Get self.pg_version for all connections."""
-        pg_versions = {connection.get_pg_version() for _, connection in
-                       self.__conn.items() if connection.get_pg_version()}
+        # Ask every connection only once, unreachable ones have no version
+        pg_versions = {pg_version for pg_version in
+                       map(PGConnection.get_pg_version, self.__conn.values())
+                       if pg_version}
         if len(pg_versions) == 1:
             return pg_versions.pop()
         raise PGConnectionException('More than one pg_version was detected in '
@@ -555,40 +753,83 @@ class PGMultiConnection():
 
 def dsn_to_connstr(dsn_params=None):
     """Convert a dict with dsn params to a connstring."""
-    return " ".join(["=".join((k, str(v))) for k, v in dsn_params.items()])
+    return " ".join("{0}={1}".format(key, quote_dsn_value(value))
+                    for key, value in dsn_params.items())
+
+
+def quote_dsn_value(value):
+    """Quote a dsn value the way libpq expects it, if it needs quoting at all."""
+    value = str(value)
+    if value and not RE_DSN_SPECIAL.search(value):
+        return value
+    return "'{0}'".format(value.replace('\\', '\\\\').replace("'", "\\'"))
 
 
 def connstr_to_dsn(connstring=''):
-    """Convert a dict with dsn params to a connstring."""
+    """
+    Convert a connstring to a dict with dsn params.
+
+    libpq does the parsing, so quoted values and URIs are handled as libpq would.
+    """
     if not connstring:
         return {}
-    connstring = connstring.strip()
-    parts = [kv.split('=', 1) for kv in connstring.split(' ')]
-    return {part[0]: part[1] for part in parts}
+    try:
+        return parse_dsn(connstring)
+    except psycopg2.ProgrammingError as error:
+        raise PGConnectionException(str(error).strip())
+
+
+@functools.lru_cache(maxsize=32)
+def parse_pg_version(text_version):
+    """
+    Convert the output of SELECT version() into a short and a numeric version.
+
+    Returns a tuple like ('PostgreSQL 9.6.3', 90603). The result is cached,
+    because every connection to the same cluster reports the same string.
+    """
+    # Most versions look like 'PostgreSQL 10.5 on ...', which plain string methods can handle
+    if text_version.startswith(('PostgreSQL ', 'EnterpriseDB ')):
+        brand, version = text_version.split(' ', 2)[:2]
+        numbers = version.split('.')
+        if len(numbers) in (2, 3) and all(number.isdigit() for number in numbers):
+            numbers.append('0')
+            return ('{0} {1}'.format(brand, version),
+                    int(numbers[0]) * 10000 + int(numbers[1]) * 100 + int(numbers[2]))
+
+    # First try as normal version number, e.a. 9.6.3 becomes 90603
+    res = RE_PG_VERSION.match(text_version)
+    if res is not None:
+        major, minor, patch = res.group(2, 3, 4)
+        return str(res.group(0)), int(major) * 10000 + int(minor) * 100 + int(patch or 0)
+
+    # Okay, then try with devel version number, e.a. 11devel becomes 110000
+    res = RE_PG_DEVEL.match(text_version)
+    if res is not None:
+        major, minor = res.group(2, 3)
+        return str(res.group(0)), int(major) * 10000 + int(minor or 0) * 100
+
+    # Seems we cannot deduce version number.
+    raise PGConnectionException('Undefined PostgreSQL version.')
 
 
 def lsn_to_xlogbyte(lsn):
     """Convert a LSN to a integer pointing to an exact byte in the wal stream."""
-    # Split by '/' character
+    # Split by '/' character, both halves are hex numbers that are not zero padded
     try:
-        xlogid, xrecoff = lsn.split('/')
+        xlogid, _, xrecoff = lsn.partition('/')
     except AttributeError:
         return 0
 
-    # Convert both from hex to int
-    xlogid = int(xlogid, 16)
-    xrecoff = int(xrecoff, 16)
-
-    # multiply wal file nr to offset by multiplying with 2**32, and add offset
+    # multiply wal file nr to offset by shifting by 32 bits, and add offset
     # in file to come to absolute int position of lsn and return result
-    return xlogid * 2**32 + xrecoff
+    return (int(xlogid, 16) << 32) + int(xrecoff, 16)
 
 
 def confbool_to_bool(confbool):
     """Convert a boolean from postgres config to a python boolean (True or False)."""
-    confbool = RE_QUOTE.sub('', confbool.lower())
-    if confbool.lower() in ['on', 'true', 'yes', '1', 1]:
+    confbool = confbool.lower().replace("'", "").replace('"', '')
+    if confbool in CONFBOOL_TRUE:
         return True
-    if confbool.lower() in ['off', 'false', 'no', '0', 0]:
+    if confbool in CONFBOOL_FALSE:
         return False
     return None
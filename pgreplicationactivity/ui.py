@@ -26,37 +26,44 @@ BASIS, AND SEBASTIAAN MANNEM HAS NO OBLIGATIONS TO PROVIDE
 MAINTENANCE, SUPPORT, UPDATES, ENHANCEMENTS, OR MODIFICATIONS.
 """
 
+import atexit
 import curses
+import functools
 import time
 import sys
-import re
-from getpass import getpass
+from operator import itemgetter, or_
 from pgreplicationactivity import config
 
 
-def get_coldef_by_name(chapter, name):
-    """Get the definition of a column by its name."""
+# Line states, used as index in UI.line_colors
+LINE_DEFAULT, LINE_CURSOR, LINE_YELLOW = range(3)
+
+# Colors of the ROLE column, by role
+ROLE_COLORS = {'master': 'role_green', 'standby': 'role_yellow'}
+
+# Column definitions indexed by mode and column name
+COLDEFS = {chapter: {coldef['name']: coldef for coldef in coldefs}
+           for chapter, coldefs in config.COLS.items()}
+
+
+@functools.lru_cache(maxsize=32)
+def get_layout(chapter, flag):
+    """
+    Return the layout of the columns displayed for a mode and a set of flags.
+
+    This is a tuple of the Query column indentation, the (title, header)
+    pairs and the (name, template) pairs used to render each row.
+    """
+    indent = ''
+    headers = []
+    row_plan = []
     for coldef in config.COLS[chapter]:
-        if coldef['name'] == name:
-            return coldef
-    return None
-
-
-def bytes2human(num):
-    """Convert a size into a human readable format."""
-    symbols = ('K', 'M', 'G', 'T', 'P', 'E', 'Z', 'Y')
-    prefix = {}
-    nume = ''
-    if num < 0:
-        num = num * -1
-        nume = '-'
-    for pos, sym in enumerate(symbols):
-        prefix[sym] = 1 << (pos+1)*10
-    for sym in reversed(symbols):
-        if num >= prefix[sym]:
-            value = "%.2f" % float(float(num) / float(prefix[sym]))
-            return "%s%s%s" % (nume, value, sym)
-    return "%s%.2fB" % (nume, num)
+        if coldef['mandatory'] or (config.FLAGS[coldef['flag']] & flag):
+            indent += coldef['template_h'] % ' '
+            headers.append((coldef['title'],
+                            coldef['template_h'] % coldef['title']))
+            row_plan.append((coldef['name'], coldef['template_h']))
+    return indent, tuple(headers), tuple(row_plan)
 
 
 class UI:
@@ -69,6 +76,18 @@ class UI:
         self.lineno = 0
         self.lines = []
         self.line_colors = None
+        # Combined color attributes, resolved by init_curses()
+        self.attr_cyan_rev = 0
+        self.attr_cyan_bold = 0
+        self.attr_green_rev = 0
+        self.attr_green_bold = 0
+        self.attr_yellow_bold = 0
+        self.attr_pause = 0
+        # (text, color) runs last printed on each line, see __print_runs()
+        self.__drawn_runs = {}
+        # Menu bars
+        self.__help_key_bar = ()
+        self.__change_mode_bar = ()
         # Sort
         self.sort = 'u'
         # Color
@@ -80,10 +99,14 @@ class UI:
         # Window's size
         self.maxy = 0
         self.maxx = 0
+        self.__halfx = 0
         # Init uibuffer
         self.uibuffer = None
         # Refresh time
         self.refresh_time = 2
+        # Poll interval, stretched while the displayed values do not change
+        self.__idle_interval = 1
+        self.__last_values = None
         # Data collector
         self.data = None
         # Maximum number of column
@@ -106,24 +129,50 @@ class UI:
     def init_curses(self,):
         """Initialize curses environment and colors."""
         self.__init_curses()
-        # Columns colors definition
-
+        # Whichever way the process ends, the terminal gets restored
+        atexit.register(self.at_exit_curses)
+        # Color pairs are only redefined by set_color()/set_nocolor(), so the
+        # combined attributes never change once curses is initialized.
+        self.attr_cyan_rev = self.__get_color(config.C_CYAN) | curses.A_REVERSE
+        self.attr_cyan_bold = self.__get_color(config.C_CYAN) | curses.A_BOLD
+        self.attr_green_rev = self.__get_color(config.C_GREEN) | curses.A_REVERSE
+        self.attr_green_bold = self.__get_color(config.C_GREEN) | curses.A_BOLD
+        self.attr_yellow_bold = self.__get_color(config.C_YELLOW) | curses.A_BOLD
+        self.attr_pause = self.__get_color(config.C_RED_BLACK) | \
+            curses.A_REVERSE | curses.A_BOLD
+
+        # Columns colors definition, indexed by column name then LINE_* state
         self.line_colors = {}
         for coldef in config.COLS['lag']:
-            self.line_colors[coldef['name']] = {
-                'default': self.__get_color(config.C_CYAN),
-                'cursor':  self.__get_color(config.C_CYAN) | curses.A_REVERSE,
-                'yellow':  self.__get_color(config.C_YELLOW) | curses.A_BOLD
-            }
-        for colname in ['yellow', 'green', 'red', 'default']:
-            self.line_colors['role_'+colname] = {
-                'cursor':  self.__get_color(config.C_CYAN) | curses.A_REVERSE,
-                'yellow':  self.__get_color(config.C_YELLOW) | curses.A_BOLD
-            }
-        self.line_colors['role_yellow']['default'] = self.__get_color(config.C_YELLOW)
-        self.line_colors['role_green']['default'] = self.__get_color(config.C_GREEN)
-        self.line_colors['role_red']['default'] = self.__get_color(config.C_RED)
-        self.line_colors['role_default']['default'] = self.__get_color(0)
+            self.line_colors[coldef['name']] = (
+                self.__get_color(config.C_CYAN),
+                self.attr_cyan_rev,
+                self.attr_yellow_bold)
+        for colname, color in [('yellow', config.C_YELLOW),
+                               ('green', config.C_GREEN),
+                               ('red', config.C_RED),
+                               ('default', 0)]:
+            self.line_colors['role_'+colname] = (
+                self.__get_color(color),
+                self.attr_cyan_rev,
+                self.attr_yellow_bold)
+
+        # Menu bars are constant, so their (text, color) runs are built only once
+        key = self.__get_color(0)
+        label = self.attr_cyan_rev
+        self.__help_key_bar = (
+            ("c", key), ("Cancel current query     ", label),
+            ("k", key), ("Terminate the backend    ", label),
+            ("Space", key), ("Tag/untag the process    ", label),
+            ("Other", key), ("Back to activity    ", label),
+            ("q", key), ("Quit    ", label))
+        self.__change_mode_bar = (
+            ("F1/1", key), ("Running queries    ", label),
+            ("F2/2", key), ("Waiting queries    ", label),
+            ("F3/3", key), ("Blocking queries ", label),
+            ("Space", key), ("Pause    ", label),
+            ("q", key), ("Quit    ", label),
+            ("h", key), ("Help    ", label))
 
     def __init_curses(self,):
         """Initialize curses environment."""
@@ -143,7 +192,9 @@ class UI:
         curses.cbreak()
         curses.endwin()
         self.win.scrollok(0)
-        (self.maxy, self.maxx) = self.win.getmaxyx()
+        # The cursor is hidden, no need to move it back after each update
+        self.win.leaveok(1)
+        self.check_window_size()
 
     def __get_color(self, color):
         """
@@ -160,7 +211,8 @@ class UI:
         Cleanup at exit of curses.
 
         This is called at exit time.
-        This method will rollback to default values.
+        This method will rollback to default values, it is safe to call it
+        more than once.
         """
         try:
             self.win.keypad(0)
@@ -169,7 +221,7 @@ class UI:
         except KeyboardInterrupt:
             pass
         except AttributeError:
-            # Curses not initialized yet
+            # Curses not initialized yet, or already cleaned up
             return
         curses.nocbreak()
         curses.echo()
@@ -178,6 +230,7 @@ class UI:
         except curses.error:
             pass
         curses.endwin()
+        self.win = None
 
     def signal_handler(self, signal, frame):
         """
@@ -223,17 +276,19 @@ class UI:
         curses.init_pair(config.C_GRAY, 0, -1)
 
     def check_window_size(self,):
-        """Update window's size."""
-        (self.maxy, self.maxx) = self.win.getmaxyx()
+        """Update window's size, return True if it has changed."""
+        size = self.win.getmaxyx()
+        if size == (self.maxy, self.maxx):
+            return False
+        (self.maxy, self.maxx) = size
+        self.__drawn_runs.clear()
+        # Banners end in the middle of the line
+        self.__halfx = self.maxx // 2
+        return True
 
     def __get_pause_msg(self,):
         """Return PAUSE message, depending of the line size."""
-        msg = "PAUSE"
-        line = ""
-        line += " " * (int(self.maxx/2) - len(msg))
-        line += msg
-        line += " " * (self.maxx - len(line) - 0)
-        return line
+        return "PAUSE".rjust(self.__halfx).ljust(self.maxx)
 
     def __pause(self,):
         """Pause the UI refresh."""
@@ -241,165 +296,49 @@ class UI:
             self.start_line,
             0,
             self.__get_pause_msg(),
-            self.__get_color(config.C_RED_BLACK) | curses.A_REVERSE | curses.A_BOLD)
+            self.attr_pause)
         while 1:
             try:
                 k = self.win.getch()
             except KeyboardInterrupt as err:
                 raise err
             if k == ord('q'):
-                curses.endwin()
-                exit()
-            if k == ord(' '):
-                curses.flushinp()
-                return 0
-
-            if k == curses.KEY_RESIZE:
+                sys.exit(0)
+            # Nothing to redraw when the size did not actually change
+            if k == curses.KEY_RESIZE and self.check_window_size():
                 if self.uibuffer is not None and 'procs' in self.uibuffer:
-                    self.check_window_size()
-                    self.refresh_window()
+                    # Redrawn frame and PAUSE banner go out with the next getch()
+                    self.refresh_window(update=False)
                     self.__print_string(self.start_line, 0,
                                         self.__get_pause_msg(),
-                                        self.__get_color(config.C_RED_BLACK) |
-                                        curses.A_REVERSE | curses.A_BOLD)
-            curses.flushinp()
+                                        self.attr_pause)
+            # Nothing to discard when getch() timed out
+            if k != -1:
+                curses.flushinp()
+            if k == ord(' '):
+                return 0
 
     def __current_position(self,):
         """Display current mode."""
         if self.mode == 'lag':
             msg = "REPLICATION LAG"
-        color = self.__get_color(config.C_GREEN)
-        line = ""
-        line += " " * (int(self.maxx/2) - len(msg))
-        line += msg
-        line += " " * (self.maxx - len(line) - 0)
-        self.__print_string(self.start_line, 0, line, color | curses.A_BOLD)
+        line = msg.rjust(self.__halfx).ljust(self.maxx)
+        self.__print_string(self.start_line, 0, line, self.attr_green_bold)
 
     def __help_key_interactive(self):
         """Display interactive mode menu bar."""
-        colno = self.__print_string(
-            (self.maxy - 1),
-            0,
-            "c",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Cancel current query     ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "k",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Terminate the backend    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Space",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Tag/untag the process    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Other",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Back to activity    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "q",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Quit    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            self.__add_blank(" "),
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
+        self.__print_menu_bar(self.__help_key_bar)
 
     def __change_mode_interactive(self):
         """Display change mode menu bar."""
-        colno = self.__print_string(
-            (self.maxy - 1),
-            0,
-            "F1/1",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Running queries    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "F2/2",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Waiting queries    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "F3/3",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Blocking queries ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Space",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Pause    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "q",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Quit    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "h",
-            self.__get_color(0))
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            "Help    ",
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
-        colno += self.__print_string(
-            (self.maxy - 1),
-            colno,
-            self.__add_blank(" "),
-            self.__get_color(config.C_CYAN) | curses.A_REVERSE)
+        self.__print_menu_bar(self.__change_mode_bar)
+
+    def __print_menu_bar(self, menu_bar):
+        """Print a menu bar, built by init_curses(), on the last line."""
+        length = sum([len(text) for text, _ in menu_bar])
+        self.__print_runs(
+            self.maxy - 1,
+            menu_bar + ((" " * (self.maxx - length), self.attr_cyan_rev),))
 
     def __interactive(self, process, flag):
         """
@@ -415,7 +354,7 @@ class UI:
 
         current_pos = 0
         offset = 0
-        self.__refresh_line(process[current_pos], flag, 'cursor',
+        self.__refresh_line(process[current_pos], flag, LINE_CURSOR,
                             self.lines[current_pos] - offset)
         self.win.timeout(int(1000))
         nb_nk = 0
@@ -430,8 +369,7 @@ class UI:
                 nb_nk += 1
             # quit
             if k == ord('q'):
-                curses.endwin()
-                exit()
+                sys.exit(0)
             # Move cursor
             if k in (curses.KEY_DOWN, curses.KEY_UP):
                 nb_nk = 0
@@ -447,7 +385,7 @@ class UI:
                         self.__refresh_line(
                             process[current_pos],
                             flag,
-                            'default',
+                            LINE_DEFAULT,
                             self.lines[current_pos] - offset)
                     current_pos -= 1
                 if k == curses.KEY_DOWN and current_pos < (len(process) - 1):
@@ -460,23 +398,21 @@ class UI:
                         self.__refresh_line(
                             process[current_pos],
                             flag,
-                            'default',
+                            LINE_DEFAULT,
                             self.lines[current_pos] - offset)
                     current_pos += 1
                 self.__refresh_line(
                     process[current_pos],
                     flag,
-                    'cursor',
+                    LINE_CURSOR,
                     self.lines[current_pos] - offset)
-                curses.flushinp()
-                continue
             if k == ord(' '):
                 known = True
 
                 self.__refresh_line(
                     process[current_pos],
                     flag,
-                    'default',
+                    LINE_DEFAULT,
                     self.lines[current_pos] - offset)
 
                 if current_pos < (len(process) - 1):
@@ -488,30 +424,28 @@ class UI:
                 self.__refresh_line(
                     process[current_pos],
                     flag,
-                    'cursor',
+                    LINE_CURSOR,
                     self.lines[current_pos] - offset)
+            if k != -1:
+                curses.flushinp()
             # Quit interactive mode
             if (k != -1 and not known) or k == curses.KEY_RESIZE:
-                curses.flushinp()
                 return 0
-            curses.flushinp()
             if nb_nk > 3:
                 return 0
 
-    def poll(self, interval, flag, indent, process=None, disp_proc=None):
-        """Poll activities."""
-        # Keyboard interactions
-        self.win.timeout(int(1000 * self.refresh_time * interval))
-        t_start = time.time()
+    def __poll_key(self, flag, disp_proc):
+        """Wait for one keypress and handle it, return (key, known)."""
         known = False
         do_refresh = False
+        # Only the header shows the refresh time
+        refresh_header = False
         try:
             key = self.win.getch()
         except KeyboardInterrupt as err:
             raise err
         if key == ord('q'):
-            curses.endwin()
-            exit()
+            sys.exit(0)
         # PAUSE mode
         if key == ord(' '):
             self.__pause()
@@ -537,10 +471,10 @@ class UI:
             known = True
         if key == ord('+') and self.refresh_time < 3:
             self.refresh_time += 1
-            do_refresh = True
+            refresh_header = True
         if key == ord('-') and self.refresh_time > 1:
             self.refresh_time -= 1
-            do_refresh = True
+            refresh_header = True
         # Refresh
         if key == ord('R'):
             known = True
@@ -550,25 +484,39 @@ class UI:
             do_refresh = True
 
         if key == curses.KEY_RESIZE and \
-           self.uibuffer is not None and 'procs' in self.uibuffer:
+           self.uibuffer is not None and 'procs' in self.uibuffer and \
+           self.check_window_size():
             do_refresh = True
 
         if do_refresh is True and self.uibuffer is not None and \
            isinstance(self.uibuffer, dict) and 'procs' in self.uibuffer:
             self.check_window_size()
             self.refresh_window()
+        elif refresh_header is True and self.uibuffer is not None and \
+                'procs' in self.uibuffer:
+            self.__refresh_header()
 
-        curses.flushinp()
-        t_end = time.time()
-        if key > -1 and not known and (t_end - t_start) < \
-                                      (self.refresh_time * interval):
-            return self.poll(
-                ((self.refresh_time * interval) -
-                 (t_end - t_start))/self.refresh_time,
-                flag,
-                indent,
-                process,
-                disp_proc)
+        if key != -1:
+            curses.flushinp()
+        return key, known
+
+    def poll(self, interval, flag, indent, process=None, disp_proc=None):
+        """Poll activities."""
+        # Keyboard interactions, until the refresh interval has elapsed or
+        # a key asking for fresh data has been pressed.
+        deadline = time.monotonic() + self.refresh_time * interval
+        remaining = self.refresh_time * interval
+        while True:
+            self.win.timeout(int(1000 * remaining))
+            key, known = self.__poll_key(flag, disp_proc)
+            if key != -1:
+                # Someone is watching, back to the normal refresh time. Forgetting the
+                # last values also keeps next_interval() from doubling it right away.
+                self.__idle_interval = 1
+                self.__last_values = None
+            remaining = deadline - time.monotonic()
+            if key == -1 or known or remaining <= 0:
+                break
 
         # poll postgresql activity
         lag_info = self.data.get_standby_info()
@@ -579,145 +527,179 @@ class UI:
         except KeyError:
             sort_key = 'host'
 
-        lag_info = sorted(lag_info, key=lambda p: p[sort_key])
+        lag_info.sort(key=itemgetter(sort_key))
 
         return (lag_info, None)
 
+    def next_interval(self, lag_info):
+        """
+        Return the interval of the next poll.
+
+        It doubles, up to config.MAX_IDLE_INTERVAL, each time the displayed
+        values are the same as in the previous poll, and falls back to 1 as
+        soon as something changes or a key is hit.
+        """
+        names = COLDEFS[self.mode]
+        values = [tuple([row.get(name) for name in names]) for row in lag_info]
+        if values == self.__last_values:
+            self.__idle_interval = min(self.__idle_interval * 2,
+                                       config.MAX_IDLE_INTERVAL)
+        else:
+            self.__idle_interval = 1
+        self.__last_values = values
+        return self.__idle_interval
+
     def __print_string(self, lineno, colno, word, color=0):
         """Print a string at position (lineno, colno) and returns its length."""
+        self.__drawn_runs.pop(lineno, None)
         try:
             self.win.addstr(lineno, colno, word, color)
         except curses.error:
             pass
         return len(word)
 
-    def __add_blank(self, line, offset=0):
-        """Complete string with white spaces from end of string to end of line."""
-        line += " " * (self.maxx - (len(line) + offset))
-        return line
+    def __print_runs(self, lineno, runs):
+        """
+        Print a line made of (text, color) runs and return its length.
+
+        The whole line is written with a single addstr() in the color that
+        covers most of it, only the runs with another color are then changed
+        with chgat(). The line is clipped to the window width, and skipped
+        entirely when the same runs are still on screen at that line.
+        """
+        if self.__drawn_runs.get(lineno) == runs:
+            return sum([len(text) for text, _ in runs])
+        win = self.win
+        lengths = {}
+        for text, color in runs:
+            lengths[color] = lengths.get(color, 0) + len(text)
+        base_color = max(lengths, key=lengths.get)
+        line = "".join([text for text, _ in runs])[:self.maxx]
+        self.__print_string(lineno, 0, line, base_color)
+        # A full line leaves the cursor on the next one, nothing to clear then
+        if len(line) < self.maxx:
+            win.clrtoeol()
+        colno = 0
+        for text, color in runs:
+            if color != base_color:
+                try:
+                    win.chgat(lineno, colno, len(text), color)
+                except curses.error:
+                    pass
+            colno += len(text)
+        self.__drawn_runs[lineno] = runs
+        return colno
+
+    def __clear_line(self, lineno):
+        """Clear a whole line."""
+        self.__drawn_runs.pop(lineno, None)
+        try:
+            self.win.move(lineno, 0)
+            self.win.clrtoeol()
+        except curses.error:
+            pass
+
+    def __clear_to_bottom(self, lineno):
+        """Clear all lines from lineno down to the bottom of the window."""
+        for drawn_lineno in [drawn_lineno for drawn_lineno in self.__drawn_runs
+                             if drawn_lineno >= lineno]:
+            del self.__drawn_runs[drawn_lineno]
+        try:
+            self.win.move(lineno, 0)
+            self.win.clrtobot()
+        except curses.error:
+            pass
 
     def get_indent(self, flag):
         """Return identation for Query column."""
-        indent = ''
-        cols = [{}] * self.max_ncol
-        for num in range(len(config.COLS[self.mode])):
-            mode = config.COLS[self.mode][num]
-            if mode['mandatory'] or (config.FLAGS[mode['flag']] & flag):
-                cols[num] = mode
-        for col in cols:
-            try:
-                indent += col['template_h'] % ' '
-            except KeyError:
-                pass
-        return indent
+        return get_layout(self.mode, flag)[0]
 
     def __print_cols_header(self, flag):
         """Print columns headers."""
-        line = ''
-        disp = ''
-        xpos = 0
-        cols = [{}] * self.max_ncol
-        color = self.__get_color(config.C_GREEN)
-        for num in range(len(config.COLS[self.mode])):
-            mode = config.COLS[self.mode][num]
-            if mode['mandatory'] or (config.FLAGS[mode['flag']] & flag):
-                cols[num] = mode
-        for val in cols:
-            if 'title' in val:
-                disp = val['template_h'] % val['title']
-                if self.sort == val['title'][0].lower() and val['title'] in \
-                   ["CPU%", "MEM%", "READ/s", "WRITE/s", "TIME+"]:
-                    color_highlight = self.__get_color(config.C_CYAN)
-                else:
-                    color_highlight = color
-                line += disp
-                self.__print_string(
-                    self.lineno,
-                    xpos,
-                    disp,
-                    color_highlight | curses.A_REVERSE)
-                xpos += len(disp)
+        runs = []
+        for title, disp in get_layout(self.mode, flag)[1]:
+            if self.sort == title[0].lower() and title in \
+               ["CPU%", "MEM%", "READ/s", "WRITE/s", "TIME+"]:
+                runs.append((disp, self.attr_cyan_rev))
+            else:
+                runs.append((disp, self.attr_green_rev))
+        self.__print_runs(self.lineno, runs)
         self.lineno += 1
 
     def __print_header(self, pg_version, conn_string, tps,
                        active_connections, size_ev, total_size):
-        """Print window header."""
+        """
+        Print window header.
+
+        Size, TPS and connection counters are not shown (yet), the header
+        only holds the version, the connection string and the refresh time,
+        plus the stretched refresh time while nothing changes.
+        """
+        # pylint: disable=W0613
         self.lineno = 0
-        colno = 0
         line = "%s - '%s' - Ref.: %ss" % (pg_version, conn_string, self.refresh_time)
-        colno = self.__print_string(self.lineno, colno, line)
-        return
-        # pylint: disable=W0101
-        colno = 0
-        self.lineno += 1
-        colno += self.__print_string(self.lineno, colno, "  Size: ")
-        colno += self.__print_string(self.lineno, colno,
-                                     "%8s" % (bytes2human(total_size),),)
-        colno += self.__print_string(self.lineno, colno,
-                                     " - %9s/s" % (bytes2human(size_ev),),)
-        colno += self.__print_string(self.lineno, colno, "        | TPS: ")
-        colno += self.__print_string(self.lineno, colno, "%11s" % (tps,),
-                                     self.__get_color(config.C_GREEN) | curses.A_BOLD)
-        colno += self.__print_string(self.lineno, colno,
-                                     "        | Active Connections: ")
-        colno += self.__print_string(self.lineno, colno,
-                                     "%11s" % (active_connections,),
-                                     self.__get_color(config.C_GREEN) | curses.A_BOLD)
+        if self.__idle_interval > 1:
+            # Nothing changed for a while, so the refresh is stretched
+            line += " (idle: %ss)" % (self.refresh_time * self.__idle_interval)
+        self.__print_string(self.lineno, 0, line)
+        self.win.clrtoeol()
+        # A header wider than the window wraps onto the blank line below it,
+        # which is only cleared when there is no wrapped tail to keep.
+        if len(line) < self.maxx:
+            self.__clear_line(self.lineno + 1)
+        # Lines the wrapped tail was written over have to be drawn again, even
+        # when their runs did not change.
+        for wrapped_lineno in range(1, len(line) // max(self.maxx, 1) + 1):
+            self.__drawn_runs.pop(self.lineno + wrapped_lineno, None)
+
+    def __refresh_header(self):
+        """Repaint the header line only."""
+        self.__print_header(
+            self.uibuffer['pg_version'],
+            self.uibuffer['conn_string'],
+            self.uibuffer['tps'],
+            self.uibuffer['active_connections'],
+            self.uibuffer['size_ev'],
+            self.uibuffer['total_size'])
+        self.win.noutrefresh()
+        curses.doupdate()
 
     def __help_window(self):
         """Display help window."""
         self.win.erase()
-        self.lineno = 0
+        self.__drawn_runs.clear()
         pgreplicationactivity = __import__('pgreplicationactivity')
         text = "pg_activity %s - (c) 2018 Sebastiaan Mannem" % \
             (pgreplicationactivity.__version__)
-        self.__print_string(self.lineno, 0, text,
-                            self.__get_color(config.C_GREEN) | curses.A_BOLD)
-        self.lineno += 1
-        text = "Released under PostgreSQL License."
-        self.__print_string(self.lineno, 0, text)
-        self.lineno += 2
-        self.__display_help_key(self.lineno, 0, "Up/Down",
-                                "scroll process list")
-        self.__display_help_key(self.lineno, 45, "      C",
-                                "activate/deactivate colors")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "  Space", "pause")
-        self.__display_help_key(self.lineno, 45, "      r",
-                                "sort by READ/s desc. (activities)")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "      v",
-                                "change display mode")
-        self.__display_help_key(self.lineno, 45, "      w",
-                                "sort by WRITE/s desc. (activities)")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "      q", "quit")
-        self.__display_help_key(self.lineno, 45, "      c",
-                                "sort by CPU% desc. (activities)")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "      +",
-                                "increase refresh time (max:3)")
-        self.__display_help_key(self.lineno, 45, "      m",
-                                "sort by MEM% desc. (activities)")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "      -",
-                                "decrease refresh time (min:1)")
-        self.__display_help_key(self.lineno, 45, "      u",
-                                "sort by UPSTREAM desc. (activities)")
-        self.__display_help_key(self.lineno, 45, "      l",
-                                "sort by LSN desc. (lsn)")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "      R", "force refresh")
-        self.lineno += 1
+        self.__print_string(0, 0, text, self.attr_green_bold)
+        self.__print_string(1, 0, "Released under PostgreSQL License.")
+        self.lineno = 3
+        for help_keys in [
+                (("Up/Down", "scroll process list"),
+                 ("      C", "activate/deactivate colors")),
+                (("  Space", "pause"),
+                 ("      r", "sort by READ/s desc. (activities)")),
+                (("      v", "change display mode"),
+                 ("      w", "sort by WRITE/s desc. (activities)")),
+                (("      q", "quit"),
+                 ("      c", "sort by CPU% desc. (activities)")),
+                (("      +", "increase refresh time (max:3)"),
+                 ("      m", "sort by MEM% desc. (activities)")),
+                (("      -", "decrease refresh time (min:1)"),
+                 ("      u", "sort by UPSTREAM desc. (activities)")),
+                (("      R", "force refresh"),
+                 ("      l", "sort by LSN desc. (lsn)"))]:
+            self.__display_help_keys(self.lineno, help_keys)
+            self.lineno += 1
         self.__print_string(self.lineno, 0, "Mode")
         self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "   F1/1", "running queries")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "   F2/2", "waiting queries")
-        self.lineno += 1
-        self.__display_help_key(self.lineno, 0, "   F3/3", "blocking queries")
+        for help_key in [("   F1/1", "running queries"),
+                         ("   F2/2", "waiting queries"),
+                         ("   F3/3", "blocking queries")]:
+            self.__display_help_keys(self.lineno, (help_key,))
+            self.lineno += 1
 
-        self.lineno += 2
+        self.lineno += 1
         self.__print_string(self.lineno, 0, "Press any key to exit.")
         self.win.timeout(-1)
         try:
@@ -725,15 +707,21 @@ class UI:
         except KeyboardInterrupt as err:
             raise err
 
-    def __display_help_key(self, lineno, colno, key, help_msg):
-        """Display help key."""
-        pos1 = self.__print_string(lineno, colno, key,
-                                   self.__get_color(config.C_CYAN) | curses.A_BOLD)
-        pos2 = self.__print_string(lineno, colno + pos1, ": %s" % (help_msg,))
-        return colno + pos1 + pos2
+    def __display_help_keys(self, lineno, help_keys):
+        """Display a line of (key, help message) pairs, 45 columns apart."""
+        runs = []
+        for key, help_msg in help_keys:
+            runs.append((key, self.attr_cyan_bold))
+            runs.append(((": %s" % (help_msg,)).ljust(45 - len(key)), 0))
+        self.__print_runs(lineno, runs)
 
-    def refresh_window(self):
-        """Refresh the window."""
+    def refresh_window(self, update=True):
+        """
+        Refresh the window.
+
+        With update=False the frame is only composed, for callers that draw
+        over it and let the next getch() send everything in one update.
+        """
         procs = self.uibuffer['procs']
         pg_version = self.uibuffer['pg_version']
         conn_string = self.uibuffer['conn_string']
@@ -743,8 +731,9 @@ class UI:
         size_ev = self.uibuffer['size_ev']
         total_size = self.uibuffer['total_size']
 
+        # The window is not erased: each line is overwritten and cleared up
+        # to its end, so curses only sees the cells that really changed.
         self.lines = []
-        self.win.erase()
         self.__print_header(
             pg_version,
             conn_string,
@@ -758,14 +747,19 @@ class UI:
         self.__print_cols_header(flag)
         for proc in procs:
             try:
-                self.__refresh_line(proc, flag, 'default')
+                self.__refresh_line(proc, flag, LINE_DEFAULT)
                 line_trunc += 1
                 self.lines.append(line_trunc)
             except curses.error:
                 break
-        for line in range(self.lineno, (self.maxy-1)):
-            self.__print_string(line, 0, self.__add_blank(" "))
+        # Clear what is left of the previous frame below the last row
+        self.__clear_to_bottom(self.lineno)
         self.__change_mode_interactive()
+        # Send the composed frame to the terminal in one go. curses compares its
+        # virtual screen with the physical one and only writes the cells that changed.
+        if update:
+            self.win.noutrefresh()
+            curses.doupdate()
 
     def __scroll_window(self, procs, flag, offset=0):
         """Scroll the window."""
@@ -773,12 +767,11 @@ class UI:
         pos = 0
         for proc in procs:
             if pos >= offset and self.lineno < (self.maxy - 1):
-                self.__refresh_line(proc, flag, 'default')
+                self.__refresh_line(proc, flag, LINE_DEFAULT)
             pos += 1
-        for line in range(self.lineno, (self.maxy-1)):
-            self.__print_string(line, 0, self.__add_blank(" "))
+        self.__clear_to_bottom(self.lineno)
 
-    def __refresh_line(self, process, flag, typecolor='default',
+    def __refresh_line(self, process, flag, typecolor=LINE_DEFAULT,
                        line=None):
         """Refresh a line for activities mode."""
         if line is not None:
@@ -786,67 +779,43 @@ class UI:
         else:
             l_lineno = self.lineno
 
-        colno = 0
-        coldef = get_coldef_by_name(self.mode, 'host')
-        word = coldef['template_h'] % (process['host'],)
-        colno += self.__print_string(l_lineno, colno, word,
-                                     self.line_colors['host'][typecolor])
-        cols = []
-        if self.mode == 'lag':
-            if flag & config.FLAGS['ROLE']:
-                if process['role'] == 'master':
-                    color_role = 'role_green'
-                elif process['role'] == 'standby':
-                    color_role = 'role_yellow'
-                else:
-                    color_role = 'role_default'
-
-                coldef = get_coldef_by_name(self.mode, 'role')
-                word = coldef['template_h'] % process['role']
-                color = self.line_colors[color_role][typecolor]
-                colno += self.__print_string(l_lineno, colno, word, color)
-            if flag & config.FLAGS['UPSTREAM']:
-                cols.append('upstream')
-            if flag & config.FLAGS['LSN']:
-                cols.append('lsn')
-            if flag & config.FLAGS['RECCONF']:
-                cols.append('recovery_conf')
-            if flag & config.FLAGS['STBYMODE']:
-                cols.append('standby_mode')
-            if flag & config.FLAGS['LAGS']:
-                cols.append('lag_sec')
-            if flag & config.FLAGS['LAGB']:
-                cols.append('lag_mb')
-            if flag & config.FLAGS['WALS']:
-                cols.append('wal_sec')
-            for col in cols:
-                coldef = get_coldef_by_name(self.mode, col)
-                word = coldef['template_h'] % (str(process[col[:35]]),)
-                color = self.line_colors[col][typecolor]
-                colno += self.__print_string(l_lineno, colno, word, color)
+        # Cells follow the same columns as the header. They are formatted once
+        # per poll and kept on the row, as a row is drawn again on every
+        # scroll, pause or resize until the next poll replaces it.
+        row_plan = get_layout(self.mode, flag)[2]
+        cells = process.get('_cells')
+        if cells is None or cells[0] is not row_plan:
+            cells = process['_cells'] = (
+                row_plan,
+                [template % (str(process[name]),) for name, template in row_plan])
+        line_colors = self.line_colors
+        runs = []
+        append = runs.append
+        for (name, _), text in zip(row_plan, cells[1]):
+            if name == 'role':
+                color = line_colors[ROLE_COLORS.get(process['role'], 'role_default')]
+            else:
+                color = line_colors[name]
+            append((text, color[typecolor]))
+        self.__print_runs(l_lineno, runs)
         self.lineno += 1
 
 
 def ask_password():
     """Ask for PostgreSQL user password."""
+    from getpass import getpass
     password = getpass()
     return password
 
 
 def clean_str(string):
     """Strip and replace some special characters."""
-    msg = str(string)
-    msg = msg.replace("\n", " ")
-    msg = re.sub(r"\s+", r" ", msg)
-    msg = msg.replace("FATAL:", "")
-    msg = re.sub(r"^\s", r"", msg)
-    msg = re.sub(r"\s$", r"", msg)
-    return msg
+    msg = str(string).replace("FATAL:", "")
+    # split() without arguments breaks on any run of whitespace (newlines
+    # included) and drops leading and trailing whitespace in one go.
+    return " ".join(msg.split())
 
 
 def get_flag_from_options():
     """Return the flag depending on the options."""
-    flag = 0
-    for _, val in config.FLAGS.items():
-        flag = flag | val
-    return flag
+    return functools.reduce(or_, config.FLAGS.values(), 0)
@@ -3,7 +3,11 @@
 import logging
 import unittest
 import unittest.mock
-from pgreplicationactivity.pgconnection import PGConnection, PGConnectionException
+import psycopg2
+from psycopg2 import errorcodes
+from pgreplicationactivity.pgconnection import PGConnection, PGMultiConnection, \
+    PGConnectionException, CONNECT_DEFAULTS, RECOVERYCONF_TTL, STANDBY_STATUS_SQL, \
+    parse_pg_version, confbool_to_bool, lsn_to_xlogbyte, connstr_to_dsn, dsn_to_connstr
 
 
 logging.disable(logging.CRITICAL)
@@ -39,13 +43,16 @@ class PGConnectionTest(unittest.TestCase):
         expected_result = [{'datname': 'template0', 'datdba': 10},
                            {'datname': 'postgres', 'datdba': 11}]
         expected_connstr = 'server=server1 dbname=postgres'
+        expected_defaults = {key: value for key, (_, value) in CONNECT_DEFAULTS.items()}
         with unittest.mock.patch('psycopg2.connect') as mock_connect:
             mock_con = mock_connect.return_value
             mock_cur = mock_con.cursor.return_value
             mock_cur.description = query_header
             mock_cur.fetchall.return_value = query_result
-            result = PGConnection(dsn_params={'server': 'server1'}, role='myrole').run_sql(test_qry)
-            mock_connect.assert_called_with(expected_connstr)
+            with unittest.mock.patch.dict('os.environ', clear=True):
+                result = PGConnection(dsn_params={'server': 'server1'},
+                                      role='myrole').run_sql(test_qry)
+            mock_connect.assert_called_with(expected_connstr, **expected_defaults)
             mock_cur.execute.assert_called_with(test_qry, None)
             self.assertEqual(result, expected_result)
             mock_cur.description = query_faulty_header
@@ -59,6 +66,93 @@ class PGConnectionTest(unittest.TestCase):
             with self.assertRaises(PGConnectionException):
                 result = PGConnection(dsn_params={'server': 'server1'}).run_sql(test_qry)
 
+    def test_mocked_connect_service(self):
+        """Test PGConnection.connect leaves the connection settings of a service alone."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            with unittest.mock.patch.dict('os.environ', clear=True):
+                PGConnection(dsn_params={'service': 'cluster1'}).connect()
+            mock_connect.assert_called_with('service=cluster1 dbname=postgres')
+            with unittest.mock.patch.dict('os.environ', {'PGSERVICE': 'cluster1'}, clear=True):
+                PGConnection(dsn_params={'host': 'server1'}).connect()
+            mock_connect.assert_called_with('host=server1 dbname=postgres')
+
+    def test_mocked_run_prepared(self):
+        """Test PGConnection.run_prepared prepares once and executes by name after that."""
+        test_qry = 'SELECT pg_is_in_recovery() AS recovery'
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_cur = mock_con.cursor.return_value
+            mock_cur.description = [("recovery",)]
+            mock_cur.fetchall.return_value = [(True,)]
+            pgconn = PGConnection(dsn_params={'server': 'server1'})
+            for _ in range(2):
+                self.assertEqual(pgconn.run_prepared('pra_test', test_qry), [{'recovery': True}])
+            self.assertEqual(mock_cur.execute.call_args_list,
+                             [unittest.mock.call('PREPARE pra_test AS ' + test_qry, None),
+                              unittest.mock.call('EXECUTE pra_test', None),
+                              unittest.mock.call('EXECUTE pra_test', None)])
+
+    def test_mocked_run_prepared_pooler(self):
+        """Test PGConnection.run_prepared copes with sessions a connection pooler hands out."""
+        class DuplicateError(psycopg2.ProgrammingError):
+            """Error for a name that is already prepared in this server session."""
+
+            pgcode = errorcodes.DUPLICATE_PREPARED_STATEMENT
+
+        class MissingError(psycopg2.OperationalError):
+            """Error for a name that is not prepared in this server session."""
+
+            pgcode = errorcodes.INVALID_SQL_STATEMENT_NAME
+
+        test_qry = 'SELECT pg_is_in_recovery() AS recovery'
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_cur = mock_con.cursor.return_value
+            mock_cur.description = [("recovery",)]
+            mock_cur.fetchall.return_value = [(True,)]
+            # The name was already prepared in this session, so it is just executed
+            mock_cur.execute.side_effect = [DuplicateError(), None]
+            pgconn = PGConnection(dsn_params={'server': 'server1'})
+            self.assertEqual(pgconn.run_prepared('pra_test', test_qry), [{'recovery': True}])
+            # Every statement lands in another session, so the query is run as is
+            mock_cur.execute.reset_mock()
+            mock_cur.execute.side_effect = [MissingError(), None, MissingError(), None]
+            self.assertEqual(pgconn.run_prepared('pra_test', test_qry), [{'recovery': True}])
+            self.assertEqual(mock_cur.execute.call_args_list,
+                             [unittest.mock.call('EXECUTE pra_test', None),
+                              unittest.mock.call('PREPARE pra_test AS ' + test_qry, None),
+                              unittest.mock.call('EXECUTE pra_test', None),
+                              unittest.mock.call(test_qry, None)])
+            # From then on only the plain query is sent, for this and other statements
+            mock_cur.execute.reset_mock()
+            mock_cur.execute.side_effect = None
+            self.assertEqual(pgconn.run_prepared('pra_test', test_qry), [{'recovery': True}])
+            pgconn.run_prepared('pra_other', 'SELECT 1')
+            self.assertEqual(mock_cur.execute.call_args_list,
+                             [unittest.mock.call(test_qry, None),
+                              unittest.mock.call('SELECT 1', None)])
+
+    def test_mocked_disconnect(self):
+        """Test PGConnection.disconnect closes the connection and forgets it."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            pgconn = PGConnection(dsn_params={'server': 'server1'})
+            pgconn.connect()
+            pgconn.disconnect()
+            mock_con.close.assert_called_once_with()
+            pgconn.disconnect()
+            mock_con.close.assert_called_once_with()
+            pgconn.connect()
+            self.assertEqual(mock_connect.call_count, 2)
+            # A broken connection is closed before a new one is made
+            mock_con.closed = 2
+            pgconn.connect()
+            self.assertEqual(mock_con.close.call_count, 2)
+            self.assertEqual(mock_connect.call_count, 3)
+
     def test_mocked_is_standby(self):
         """Test PGConnection.is_standby for normal functionality."""
         query_header = [("recovery",)]
@@ -71,6 +165,200 @@ class PGConnectionTest(unittest.TestCase):
                 result = PGConnection(dsn_params={'server': 'server1'}).is_standby()
                 self.assertEqual(result, expected_result)
 
+    def test_mocked_hostid(self):
+        """Test PGConnection.hostid asks the server only once, and falls back to the dsn."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_cur = mock_con.cursor.return_value
+            mock_cur.description = [("ip",), ("port",)]
+            mock_cur.fetchall.return_value = [('10.0.0.1', 5433)]
+            pgconn = PGConnection(dsn_params={'host': 'server1', 'port': '5432'})
+            for _ in range(2):
+                self.assertEqual(pgconn.hostid(), '10.0.0.1:5433')
+            self.assertEqual(mock_cur.execute.call_count, 1)
+            mock_connect.side_effect = psycopg2.OperationalError
+            pgconn = PGConnection(dsn_params={'host': 'server1', 'port': '5432'})
+            self.assertEqual(pgconn.hostid(), 'server1:5432')
+
+    def test_mocked_versions(self):
+        """Test PGConnection reads the numeric version from libpq and the short one once."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_con.server_version = 100005
+            mock_cur = mock_con.cursor.return_value
+            mock_cur.fetchone.return_value = ('PostgreSQL 10.5 on x86_64-pc-linux-gnu',)
+            pgconn = PGConnection(dsn_params={'server': 'server1'})
+            self.assertEqual(pgconn.get_num_version(), 100005)
+            mock_cur.execute.assert_not_called()
+            for _ in range(2):
+                self.assertEqual(pgconn.get_pg_version(), 'PostgreSQL 10.5')
+            self.assertEqual(mock_cur.execute.call_count, 1)
+
+    def test_mocked_current_time_lag_lsn(self):
+        """Test PGConnection.current_time_lag_lsn reads role, time, lag and lsn in one query."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_cur = mock_con.cursor.return_value
+            pgconn = PGConnection(dsn_params={'server': 'server1'})
+            pgconn.pg_num_version = 100005
+            mock_cur.description = [("recovery",), ("now",), ("lsn",), ("lag_sec",)]
+            mock_cur.fetchall.return_value = [(True, 1000, '1/10', 2)]
+            result = pgconn.current_time_lag_lsn()
+            self.assertEqual(result, {'now': 1000, 'lsn': '1/10', 'lag_sec': 2,
+                                      'lsn_int': 2**32 + 16, 'wal_sec': 0})
+            queries = [call[0][0] for call in mock_cur.execute.call_args_list]
+            self.assertEqual(len(queries), 2)
+            self.assertIn('pg_last_wal_replay_lsn()', queries[0])
+            self.assertEqual(queries[1], 'EXECUTE pra_time_lag_lsn')
+
+    def test_mocked_get_standby_info(self):
+        """Test PGConnection.get_standby_info reads role and upstream in one query."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_con.server_version = 100005
+            mock_cur = mock_con.cursor.return_value
+            mock_cur.description = [("recovery",), ("conninfo",)]
+            mock_cur.fetchall.return_value = [(True, 'user=rep host=up1 port=5433')]
+            mock_cur.fetchone.return_value = (False,)
+            result = PGConnection(dsn_params={'server': 'server1'}).get_standby_info()
+            self.assertEqual(result['role'], 'standby')
+            self.assertEqual(result['upstream'], 'v: up1:5433')
+            queries = [call[0][0] for call in mock_cur.execute.call_args_list]
+            self.assertEqual(queries[:2], ['PREPARE pra_standby_status AS ' +
+                                           STANDBY_STATUS_SQL[True],
+                                           'EXECUTE pra_standby_status'])
+
+    def test_mocked_get_upstream(self):
+        """Test PGConnection.get_upstream shares its prepared statement with get_standby_info."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_con.server_version = 100005
+            mock_cur = mock_con.cursor.return_value
+            mock_cur.description = [("recovery",), ("conninfo",)]
+            mock_cur.fetchall.return_value = [(True, 'user=rep host=up1 port=5433')]
+            mock_cur.fetchone.return_value = (False,)
+            pgconn = PGConnection(dsn_params={'server': 'server1'})
+            pgconn.get_standby_info()
+            mock_cur.execute.reset_mock()
+            self.assertEqual(pgconn.get_upstream(), 'v: up1:5433')
+            queries = [call[0][0] for call in mock_cur.execute.call_args_list]
+            self.assertEqual(queries, ['EXECUTE pra_standby_status'])
+
+    def test_mocked_get_standby_info_down(self):
+        """Test a server that is down costs one connection attempt per refresh."""
+        with unittest.mock.patch('psycopg2.connect',
+                                 side_effect=psycopg2.OperationalError) as mock_connect:
+            multi = PGMultiConnection(dsn_params={'host': 'h1', 'port': '5432'})
+            multi.connect()
+            mock_connect.reset_mock()
+            result = multi.get_standby_info()
+            multi.disconnect()
+            self.assertEqual(mock_connect.call_count, 1)
+            self.assertEqual(result[0]['role'], 'Down')
+            self.assertEqual(result[0]['host'], 'h1:5432')
+
+    def test_mocked_recoveryconf(self):
+        """Test PGConnection.recoveryconf only reads recovery.conf again after its TTL."""
+        recoveryconf = "standby_mode = 'on'\nprimary_slot_name = 'slot1'\n"
+        with unittest.mock.patch('psycopg2.connect') as mock_connect, \
+                unittest.mock.patch('time.monotonic') as mock_monotonic:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_con.server_version = 110005
+            mock_cur = mock_con.cursor.return_value
+
+            def fetchone():
+                """Return rolsuper or the recovery.conf contents, depending on the last query."""
+                if 'rolsuper' in mock_cur.execute.call_args[0][0]:
+                    return (True,)
+                return (recoveryconf,)
+            mock_cur.fetchone.side_effect = fetchone
+            pgconn = PGConnection(dsn_params={'server': 'server1'})
+            for now in [100, 100 + RECOVERYCONF_TTL - 1, 100 + RECOVERYCONF_TTL]:
+                mock_monotonic.return_value = now
+                self.assertEqual(pgconn.recoveryconf(),
+                                 {'standby_mode': "'on'", 'primary_slot_name': "'slot1'"})
+            reads = [call for call in mock_cur.execute.call_args_list
+                     if 'pg_read_file' in call[0][0]]
+            self.assertEqual(len(reads), 2)
+
+    def test_mocked_recovery_settings(self):
+        """Test PGConnection.recoveryconf reads settings and standby.signal from PG12 on."""
+        with unittest.mock.patch('psycopg2.connect') as mock_connect:
+            mock_con = mock_connect.return_value
+            mock_con.closed = False
+            mock_con.server_version = 120002
+            mock_cur = mock_con.cursor.return_value
+            mock_cur.fetchone.return_value = (True,)
+            mock_cur.description = [("standby_mode",), ("primary_conninfo",),
+                                    ("primary_slot_name",)]
+            mock_cur.fetchall.return_value = [(True, 'host=server2', 'slot1')]
+            self.assertEqual(PGConnection(dsn_params={'server': 'server1'}).recoveryconf(),
+                             {'standby_mode': 'on', 'primary_conninfo': 'host=server2',
+                              'primary_slot_name': 'slot1'})
+            mock_cur.fetchall.return_value = [(False, '', '')]
+            self.assertIs(PGConnection(dsn_params={'server': 'server1'}).recoveryconf(), False)
+            self.assertFalse([call for call in mock_cur.execute.call_args_list
+                              if 'pg_read_file' in call[0][0]])
+
+
+class HelperFunctionsTest(unittest.TestCase):
+    """Test the helper functions of the pgconnection module."""
+
+    def test_parse_pg_version(self):
+        """Test parse_pg_version for normal, devel and unknown versions."""
+        for text_version, expected_result in [
+                ('PostgreSQL 9.6.3 on x86_64-pc-linux-gnu', ('PostgreSQL 9.6.3', 90603)),
+                ('PostgreSQL 10.5 (Debian 10.5-1.pgdg90+1) on x86_64-pc-linux-gnu',
+                 ('PostgreSQL 10.5', 100500)),
+                ('EnterpriseDB 9.5.12.17 on x86_64-pc-linux-gnu', ('EnterpriseDB 9.5.12', 90512)),
+                ('PostgreSQL 11devel on x86_64-pc-linux-gnu', ('PostgreSQL 11devel', 110000)),
+                ('PostgreSQL 9.6beta1 on x86_64-pc-linux-gnu', ('PostgreSQL 9.6', 90600))]:
+            self.assertEqual(parse_pg_version(text_version), expected_result)
+        with self.assertRaises(PGConnectionException):
+            parse_pg_version('MySQL 5.7.22')
+
+    def test_connstr_to_dsn(self):
+        """Test connstr_to_dsn for normal, untidy, quoted, uri, empty and invalid connstrings."""
+        for connstring, expected_result in [
+                ('host=server1 port=5433', {'host': 'server1', 'port': '5433'}),
+                (' host=server1  application_name=a=b ',
+                 {'host': 'server1', 'application_name': 'a=b'}),
+                ("host=server1 password='a b'", {'host': 'server1', 'password': 'a b'}),
+                ('postgresql://server1:5433', {'host': 'server1', 'port': '5433'}),
+                ('  ', {}), ('', {}), (None, {})]:
+            self.assertEqual(connstr_to_dsn(connstring), expected_result)
+        with self.assertRaises(PGConnectionException):
+            connstr_to_dsn('server1')
+
+    def test_dsn_to_connstr(self):
+        """Test dsn_to_connstr only quotes values that need it, and libpq reads them back."""
+        dsn = {'host': 'server1', 'port': 5433, 'password': "a b'c\\d", 'application_name': ''}
+        connstr = dsn_to_connstr(dsn)
+        self.assertEqual(connstr, "host=server1 port=5433 password='a b\\'c\\\\d' "
+                                  "application_name=''")
+        self.assertEqual(connstr_to_dsn(connstr), dict(dsn, port='5433'))
+
+    def test_lsn_to_xlogbyte(self):
+        """Test lsn_to_xlogbyte for padded, unpadded and missing lsns."""
+        for lsn, expected_result in [
+                ('0/0', 0), ('0/3000060', 0x3000060), ('1/10', 2**32 + 16),
+                ('16/B374D848', 0x16 * 2**32 + 0xB374D848), (None, 0)]:
+            self.assertEqual(lsn_to_xlogbyte(lsn), expected_result)
+
+    def test_confbool_to_bool(self):
+        """Test confbool_to_bool for quoted, mixed case and unknown values."""
+        for confbool, expected_result in [
+                ('on', True), ("'On'", True), ('"yes"', True), ('1', True),
+                ('off', False), ("'FALSE'", False), ('0', False),
+                ('maybe', None)]:
+            self.assertIs(confbool_to_bool(confbool), expected_result)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,47 @@
+"""This module holds all unit tests for the ui module and its main loop."""
+
+import unittest
+import unittest.mock
+from pgreplicationactivity import config, pg_replication_activity, ui
+
+
+class UITest(unittest.TestCase):
+    """Test the UI Class."""
+
+    def test_next_interval(self):
+        """Test UI.next_interval doubles while nothing changes, and falls back to 1."""
+        pgaui = ui.UI()
+        rows = [{'host': 'h1:5432', 'lsn': '0/10'}]
+        intervals = [pgaui.next_interval(rows) for _ in range(5)]
+        self.assertEqual(intervals, [1, 2, 4, config.MAX_IDLE_INTERVAL,
+                                     config.MAX_IDLE_INTERVAL])
+        self.assertEqual(pgaui.next_interval([{'host': 'h1:5432', 'lsn': '0/20'}]), 1)
+
+    def test_main_loop(self):
+        """Test main() feeds the rows that poll() returns to next_interval()."""
+        pgaui = ui.UI()
+        pgaui.data = unittest.mock.Mock()
+        rows = [{'host': 'h1:5432', 'lsn': '0/10'}]
+        with unittest.mock.patch.object(ui, 'UI', return_value=pgaui), \
+                unittest.mock.patch.object(pg_replication_activity, 'try_connecting',
+                                           return_value='host=h1'), \
+                unittest.mock.patch('sys.argv', ['pg_replication_activity']), \
+                unittest.mock.patch.object(pgaui, 'init_curses'), \
+                unittest.mock.patch.object(pgaui, 'set_color'), \
+                unittest.mock.patch.object(pgaui, 'check_window_size'), \
+                unittest.mock.patch.object(pgaui, 'at_exit_curses'), \
+                unittest.mock.patch.object(pgaui, 'poll', return_value=(rows, None)), \
+                unittest.mock.patch.object(pgaui, 'next_interval',
+                                           wraps=pgaui.next_interval) as next_interval, \
+                unittest.mock.patch.object(pgaui, 'refresh_window',
+                                           side_effect=[None, None, KeyboardInterrupt]):
+            with self.assertRaises(SystemExit) as context:
+                pg_replication_activity.main()
+        # Stopped by the KeyboardInterrupt on the third refresh, not by an error
+        self.assertEqual(context.exception.code, 1)
+        self.assertEqual(next_interval.call_args_list, [unittest.mock.call(rows)] * 3)
+        pgaui.data.disconnect.assert_called_once_with()
+
+
+if __name__ == '__main__':
+    unittest.main()